@@ -16,5 +16,6 @@ setup(
     license="MIT",
     long_description=long_description,
     long_description_content_type="text/markdown",
+    extras_require={"pdf": ["pypdf"], "orjson": ["orjson"]},
     entry_points={'console_scripts': ['streamlit-openai=streamlit_openai.__main__:main']}
 )
\ No newline at end of file
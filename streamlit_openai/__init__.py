@@ -1,2 +1,8 @@
 from .utils import CustomFunction, RemoteMCP
-from .chat import Chat
\ No newline at end of file
+
+def __getattr__(name):
+    # Chat imports Streamlit, which the command-line interface does not need
+    if name == "Chat":
+        from .chat import Chat
+        return Chat
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,10 +1,22 @@
 import streamlit as st
 import openai
-import os, json, re, tempfile, zipfile, time, base64, shutil
+import os, io, json, re, tempfile, zipfile, time, base64, shutil, random, queue, threading, functools, hashlib, collections
 from pathlib import Path
-from typing import Optional, List, Union, Literal, Dict, Any
+from typing import Optional, List, Union, Literal, Dict, Any, Callable, Iterable, Iterator, BinaryIO
 from .utils import CustomFunction, RemoteMCP
 from streamlit.runtime.uploaded_file_manager import UploadedFile
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 DEVELOPER_MESSAGE = """
 - Use GitHub-flavored Markdown in your response, including tables, images, URLs, code blocks, and lists.
@@ -17,21 +29,59 @@ CHAT_HISTORY_INSTRUCTIONS = """
 - All input files uploaded so far were actually provided previously, so you should not treat them as new uploads.
 """
 
-CODE_INTERPRETER_EXTENSIONS = [
+CODE_INTERPRETER_EXTENSIONS = frozenset({
     ".c", ".cs", ".cpp", ".csv", ".doc", ".docx", ".html", 
     ".java", ".json", ".md", ".pdf", ".php", ".pptx", ".py", 
-    ".rb", ".tex", ".txt", ".css", ".js", ".sh", ".ts", ".csv", 
+    ".rb", ".tex", ".txt", ".css", ".js", ".sh", ".ts", 
     ".jpeg", ".jpg", ".gif", ".pkl", ".png", ".tar", ".xlsx", 
     ".xml", ".zip"
-]
+})
 
-FILE_SEARCH_EXTENSIONS = [
+FILE_SEARCH_EXTENSIONS = frozenset({
     ".c", ".cpp", ".cs", ".css", ".doc", ".docx", ".go", 
     ".html", ".java", ".js", ".json", ".md", ".pdf", ".php", 
     ".pptx", ".py", ".rb", ".sh", ".tex", ".ts", ".txt"
-]
+})
+
+VISION_EXTENSIONS = frozenset({".png", ".jpeg", ".jpg", ".webp", ".gif"})
+
+# Formats that gain little from being compressed again when saving a chat
+COMPRESSED_EXTENSIONS = frozenset({
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".pdf", ".zip", ".gz",
+    ".xlsx", ".docx", ".pptx"
+})
+
+# Containers expire after 20 minutes of inactivity, so one that was used within
+# this many seconds is not checked again
+CONTAINER_CHECK_INTERVAL = 60
+
+# Minimum number of seconds between two renders of a streaming section
+STREAM_INTERVAL = 0.05
+
+# Maximum number of stream events read ahead of the ones being rendered
+STREAM_BUFFER_SIZE = 1024
+
+# Maximum number of seconds to wait for OpenAI to finish processing a file
+POLL_TIMEOUT = 300
+
+# Maximum number of times function outputs are sent back within one response
+MAX_TOOL_ROUNDS = 10
 
-VISION_EXTENSIONS = [".png", ".jpeg", ".jpg", ".webp", ".gif"]
+# Maximum number of responses kept for identical requests made with a temperature of 0
+RESPONSE_CACHE_SIZE = 128
+
+# Links to code interpreter files, which are rewritten as plain file names
+SANDBOX_LINK_PATTERN = re.compile(r"!?\[([^\]]+)\]\(sandbox:/mnt/data/([^\)]+)\)")
+
+# A Markdown link that is still being streamed at the end of the text
+PENDING_LINK_PATTERN = re.compile(r"!?(?:\[[^\]]*(?:\](?:\([^\)]*)?)?)?\Z")
+
+# The input item an API error refers to (e.g., "input[2].content[0].file_id")
+INPUT_PARAM_PATTERN = re.compile(r"input\[(\d+)\]")
+
+# Limits for PDFs that are passed to the model directly as file inputs
+PDF_MAX_PAGES = 100
+PDF_MAX_BYTES = 32 * 1024 * 1024
 
 MIME_TYPES = {
     "txt" : "text/plain",
@@ -65,6 +115,131 @@ SUMMARY_INSTRUCTIONS = """
 - If the conversation history does not provide enough information to summarize, return "New Chat".
 """
 
+def _is_pdf_processable(f: BinaryIO) -> bool:
+    """Checks locally whether a PDF can be passed to the model as a file input."""
+    if f.seek(0, os.SEEK_END) > PDF_MAX_BYTES:
+        return False
+    f.seek(0)
+    if not f.read(5) == b"%PDF-":
+        return False
+    if PdfReader is None:
+        return True
+    try:
+        reader = PdfReader(f)
+        return not reader.is_encrypted and len(reader.pages) <= PDF_MAX_PAGES
+    except Exception:
+        return False
+
+def _json_loads(data: Union[str, bytes]) -> Any:
+    """Parses JSON, using orjson if it is installed."""
+    return json.loads(data) if orjson is None else orjson.loads(data)
+
+def _json_dumps(obj: Any) -> str:
+    """Serializes an object to compact JSON, using orjson if it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # orjson rejects values the standard library accepts, like integers over 64 bits
+            pass
+    return json.dumps(obj, ensure_ascii=False, default=str)
+
+@functools.lru_cache(maxsize=8)
+def _get_client(api_key: Optional[str]) -> openai.OpenAI:
+    """Returns a shared OpenAI client so its connection pool survives reruns and new chats."""
+    # Connection errors, 408/409/429, and 5xx responses are retried with exponential backoff
+    return openai.OpenAI(api_key=api_key, max_retries=3)
+
+@functools.lru_cache(maxsize=8)
+def _get_file_hash_cache(api_key: Optional[str]) -> Dict[str, str]:
+    """Returns the IDs of files uploaded with an API key, by purpose and content hash, shared by all sessions."""
+    return {}
+
+def _poll_until_done(
+    retrieve: Callable[[], Any],
+    initial: float = 0.1,
+    cap: float = 5.0,
+    factor: float = 1.8,
+    timeout: float = POLL_TIMEOUT,
+) -> Any:
+    """Polls an OpenAI object until it is completed, failed or cancelled, backing off exponentially."""
+    deadline = time.monotonic() + timeout
+    delay = initial
+    result = retrieve()
+    while result.status not in ["completed", "failed", "cancelled"]:
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"OpenAI object {result.id} did not complete within {timeout} seconds.")
+        time.sleep(delay + random.uniform(0, delay * 0.1))
+        delay = min(delay * factor, cap)
+        result = retrieve()
+    return result
+
+def _iter_in_background(
+    events: Iterable[Any],
+    on_idle: Optional[Callable[[], None]] = None,
+) -> Iterator[Any]:
+    """Reads a response stream on a background thread and yields its events, calling `on_idle` while none arrive."""
+    buffer = queue.Queue(maxsize=STREAM_BUFFER_SIZE)
+    done = object()
+    errors = []
+    stop = threading.Event()
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=STREAM_INTERVAL)
+                return
+            except queue.Full:
+                pass
+    def read():
+        try:
+            for event in events:
+                if stop.is_set():
+                    break
+                put(event)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(done)
+    threading.Thread(target=read, daemon=True).start()
+    try:
+        while True:
+            try:
+                event = buffer.get(timeout=STREAM_INTERVAL)
+            except queue.Empty:
+                if on_idle is not None:
+                    on_idle()
+                continue
+            if event is done:
+                break
+            yield event
+    finally:
+        # The consumer may stop early (e.g. a Streamlit rerun), so let the reader go
+        stop.set()
+        close = getattr(events, "close", None)
+        if close is not None:
+            close()
+    if errors:
+        raise errors[0]
+
+_response_cache = collections.OrderedDict()
+_response_cache_lock = threading.Lock()
+
+def _get_cached_response(key: str) -> Optional[Any]:
+    """Returns a cached response for an identical request, if there is one."""
+    with _response_cache_lock:
+        if key not in _response_cache:
+            return None
+        _response_cache.move_to_end(key)
+        return _response_cache[key]
+
+def _cache_response(key: str, response: Any) -> None:
+    """Caches a response, evicting the least recently used one if the cache is full."""
+    with _response_cache_lock:
+        _response_cache[key] = response
+        _response_cache.move_to_end(key)
+        if len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
 class Chat():
     """A Streamlit-based chat interface powered by OpenAI's Responses API."""
     def __init__(
@@ -115,7 +290,7 @@ class Chat():
         """
         self.api_key = os.getenv("OPENAI_API_KEY") if api_key is None else api_key
         self.model = model
-        self.instructions = "" if instructions is None else instructions
+        self.instructions = instructions
         self.temperature = temperature
         self.accept_file = accept_file
         self.uploaded_files = uploaded_files
@@ -135,33 +310,37 @@ class Chat():
         self.summary = "New Chat"
         self.input_tokens = 0
         self.output_tokens = 0
-        self._client = openai.OpenAI(api_key=self.api_key)
-        self._temp_dir = tempfile.TemporaryDirectory()
+        self._client = _get_client(self.api_key)
+        self._temp_dir = None
         self._selected_example = None
         self._input = []
         self._tools = []
+        self._tools_by_type = {}
         self._previous_response_id = None
         self._container_id = None
+        self._container_checked_at = 0.0
         self._sections = []
+        self._has_user_turn = False
         self._static_files = []
         self._tracked_files = []
+        self._tracked_file_ids = set()
         self._download_button_key = 0
         self._dynamic_vector_store = None
+        self._summary_thread = None
+        self._summary_fingerprint = None
+        self._lock = threading.Lock()
+        self._file_hash_cache = {}
+        self._functions_by_name = {x.name: x for x in self.functions or []}
 
         if self.allow_web_search:
-            self._tools.append({"type": "web_search"})
+            self.add_tool({"type": "web_search"})
 
         if self.allow_image_generation:
-            self._tools.append({"type": "image_generation", "partial_images": 3})
-
-        if self.allow_code_interpreter:
-            container = self._client.containers.create(name="streamlit-openai")
-            self._container_id = container.id
-            self._tools.append({"type": "code_interpreter", "container": self._container_id})
+            self.add_tool({"type": "image_generation", "partial_images": 3})
 
         if self.functions is not None:
             for function in self.functions:
-                self._tools.append({
+                self.add_tool({
                     "type": "function",
                     "name": function.name,
                     "description": function.description,
@@ -170,7 +349,7 @@ class Chat():
 
         if self.mcps is not None:
             for mcp in self.mcps:
-                self._tools.append({
+                self.add_tool({
                     "type": "mcp",
                     "server_label": mcp.server_label,
                     "server_url": mcp.server_url,
@@ -181,7 +360,7 @@ class Chat():
 
         # File search currently allows a maximum of two vector stores
         if allow_file_search and self.vector_store_ids is not None:
-            self._tools.append({
+            self.add_tool({
                 "type": "file_search",
                 "vector_store_ids": self.vector_store_ids
             })
@@ -196,40 +375,56 @@ class Chat():
 
         # If files are uploaded statically, create tracked files for them
         if self.uploaded_files is not None:
-            for uploaded_file in self.uploaded_files:
-                shutil.copy(uploaded_file, self._temp_dir.name)
-                self.track(os.path.join(self._temp_dir.name, os.path.basename(uploaded_file)))
-                self._static_files.append(self._tracked_files[-1])
+            self.track_static_files(self.uploaded_files)
+
+    @property
+    def instructions(self) -> str:
+        """Returns the instructions for the assistant."""
+        return self._instructions
+
+    @instructions.setter
+    def instructions(self, instructions) -> None:
+        """Sets the instructions, along with the full instructions sent to the model."""
+        self._instructions = "" if instructions is None else instructions
+        self._full_instructions = DEVELOPER_MESSAGE + self._instructions
+
+    @property
+    def temp_dir(self) -> tempfile.TemporaryDirectory:
+        """Returns the chat's temporary directory, creating it on first use."""
+        if self._temp_dir is None:
+            self._temp_dir = tempfile.TemporaryDirectory()
+        return self._temp_dir
 
     @property
     def last_section(self) -> Optional["Section"]:
         """Returns the last section of the chat."""
         return self._sections[-1] if self._sections else None
 
-    def summarize(self) -> None:
-        """Update the chat summary."""
+    def serialize_sections(self) -> List[Dict[str, Any]]:
+        """Returns the sections as JSON-serializable dictionaries, with file contents left out."""
         sections = []
         for section in self._sections:
             s = {"role": section.role, "blocks": []}
-            for block in section.blocks:
-                if block.category in ["text", "code", "reasoning"]:
-                    content = block.content
-                else:
-                    content = "Bytes"
+            for block in section.blocks or []:
                 s["blocks"].append({
                     "category": block.category,
-                    "content": content,
+                    "content": block.content if block.category in ["text", "code", "reasoning"] else "Bytes",
                     "filename": block.filename,
                     "file_id": block.file_id
                 })
             sections.append(s)
+        return sections
+
+    def summarize(self) -> None:
+        """Update the chat summary."""
+        sections = self.serialize_sections()
         if sections:
             result = self._client.chat.completions.create(
                 model="gpt-4o",
                 temperature=0.001,
                 messages=[
                     {"role": "developer", "content": SUMMARY_INSTRUCTIONS},
-                    {"role": "user", "content": json.dumps(sections, indent=4)}
+                    {"role": "user", "content": json.dumps(sections, separators=(",", ":"), ensure_ascii=False)}
                 ]
             )
             self.summary = result.choices[0].message.content
@@ -238,26 +433,23 @@ class Chat():
         """Saves the chat history to a ZIP file."""
         if not file_path.endswith(".zip"):
             raise ValueError("File path must end with .zip")
-        with tempfile.TemporaryDirectory() as t:
-            sections = []
+        root = Path(file_path).stem
+        # The fastest compression level, since most of the size is in files that compress poorly
+        with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as f:
+            written = set()
+            def write(name, content):
+                if name in written:
+                    return
+                written.add(name)
+                # Files that are already compressed are stored as is
+                compress_type = zipfile.ZIP_STORED if Path(name).suffix.lower() in COMPRESSED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                f.writestr(f"{root}/{name}", content, compress_type=compress_type)
             for section in self._sections:
-                s = {"role": section.role, "blocks": []}
-                for block in section.blocks:
-                    if block.category in ["text", "code", "reasoning"]:
-                        content = block.content
-                    else:
-                        with open(f"{t}/{block.file_id}-{block.filename}", "wb") as f:
-                            f.write(block.content)
-                        content = "Bytes"
-                    s["blocks"].append({
-                        "category": block.category,
-                        "content": content,
-                        "filename": block.filename,
-                        "file_id": block.file_id
-                    })
-                sections.append(s)
+                for block in section.blocks or []:
+                    if block.category not in ["text", "code", "reasoning"]:
+                        write(f"{block.file_id}-{block.filename}", block.content)
             for static_file in self._static_files:
-                shutil.copy(static_file._file_path, t)
+                write(static_file._file_path.name, static_file._file_path.read_bytes())
             data = {
                 "model": self.model,
                 "instructions": self.instructions,
@@ -275,35 +467,28 @@ class Chat():
                 "allow_file_search": self.allow_file_search,
                 "allow_web_search": self.allow_web_search,
                 "allow_image_generation": self.allow_image_generation,
-                "sections": sections,
+                "sections": self.serialize_sections(),
+                "file_hash_cache": self._file_hash_cache,
             }
-            with open(f"{t}/data.json", "w") as f:
-                json.dump(data, f, indent=4)
-            with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED) as f:
-                for root, dirs, files in os.walk(t):
-                    for file in files:
-                        f.write(
-                            os.path.join(root, file),
-                            arcname=os.path.join(os.path.basename(file_path.replace(".zip", "")), file)
-                        )
+            if orjson is None:
+                write("data.json", json.dumps(data, indent=4))
+            else:
+                write("data.json", orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
     @classmethod
     def load(cls, history) -> "Chat":
         """Loads a chat history from a ZIP file."""
         if not history.endswith(".zip"):
             raise ValueError("History file must end with .zip")
-        with tempfile.TemporaryDirectory() as t:
-            with zipfile.ZipFile(history, "r") as f:
-                f.extractall(t)
-            dir_path = f"{t}/{history.replace('.zip', '')}" 
-            with open(f"{dir_path}/data.json", "r") as f:
-                data = json.load(f)
+        root = Path(history).stem
+        with zipfile.ZipFile(history, "r") as f:
+            data = _json_loads(f.read(f"{root}/data.json"))
             chat = cls(
                 model=data["model"],
                 instructions=data["instructions"],
                 temperature=data["temperature"],
                 accept_file=data["accept_file"],
-                uploaded_files=None if data["uploaded_files"] is None else [f"{dir_path}/{os.path.basename(x)}" for x in data["uploaded_files"]],
+                uploaded_files=None,
                 user_avatar=data["user_avatar"],
                 assistant_avatar=data["assistant_avatar"],
                 placeholder=data["placeholder"],
@@ -315,6 +500,22 @@ class Chat():
                 allow_web_search=data["allow_web_search"],
                 allow_image_generation=data["allow_image_generation"],
             )
+            # Only the files that are needed are extracted, into the chat's own directory
+            dir_path = chat.temp_dir.name
+            def extract(name):
+                # Names come from data.json, so they must not point outside the directory
+                if "\\" in name or Path(name).name != name or name in ("", ".", ".."):
+                    raise ValueError(f"Invalid file name in chat history: {name!r}")
+                content = f.read(f"{root}/{name}")
+                path = f"{dir_path}/{name}"
+                with open(path, "wb") as g:
+                    g.write(content)
+                return path, content
+            # Static files are tracked once the cache of previous uploads is restored
+            chat._file_hash_cache.update(data.get("file_hash_cache", {}))
+            if data["uploaded_files"] is not None:
+                chat.uploaded_files = [extract(Path(x).name)[0] for x in data["uploaded_files"]]
+                chat.track_static_files(chat.uploaded_files)
             for section in data["sections"]:
                 chat.add_section(section["role"], blocks=[])
                 for block in section["blocks"]:
@@ -327,9 +528,7 @@ class Chat():
                             block["category"], block["content"]
                         ))
                     else:
-                        uploaded_file = f"{dir_path}/{block['file_id']}-{block['filename']}"
-                        with open(uploaded_file, "rb") as f:
-                            content = f.read()
+                        uploaded_file, content = extract(f"{block['file_id']}-{block['filename']}")
                         chat.track(uploaded_file)
                         chat._sections[-1].blocks.append(chat.create_block(
                             block["category"],
@@ -344,9 +543,258 @@ class Chat():
         """Sends the user prompt to the assistant and streams the response."""
         self._input.append({"role": "user", "content": prompt})
         self.add_section("assistant")
+        # The section is looked up once, since handlers below run for every streamed event
+        section = self.last_section
         if self.allow_code_interpreter:
-            result = self._client.containers.retrieve(container_id=self._container_id)
-            if result.status == "expired":
+            if self._container_id is not None and time.monotonic() - self._container_checked_at > CONTAINER_CHECK_INTERVAL:
+                result = self._client.containers.retrieve(container_id=self._container_id)
+                if result.status == "expired":
+                    self._container_id = None
+            self.ensure_container()
+            self._container_checked_at = time.monotonic()
+        # With a temperature of 0, an identical request (e.g., an example message
+        # at the start of a new chat) replays the earlier answer instead
+        cache_key = None
+        if self.temperature == 0:
+            cache_key = hashlib.sha256(_json_dumps([
+                self.api_key,
+                self.model,
+                self._full_instructions,
+                self._previous_response_id,
+                [{k: v for k, v in tool.items() if k != "container"} for tool in self._tools],
+                self._input,
+            ]).encode()).hexdigest()
+            cached = _get_cached_response(cache_key)
+            if cached is not None:
+                self._previous_response_id, blocks = cached
+                for category, content in blocks:
+                    section.update(category, content)
+                section.stream()
+                self._input = []
+                return
+        def create():
+            return self._client.responses.create(
+                model=self.model,
+                input=self._input,
+                instructions=self._full_instructions,
+                temperature=self.temperature,
+                tools=self._tools,
+                previous_response_id=self._previous_response_id,
+                stream=True,
+                reasoning={"summary": "auto"},
+            )
+        try:
+            events1 = create()
+        except openai.BadRequestError as e:
+            # A PDF that passed the local checks can still be rejected as a file input
+            if not self.fall_back_to_file_search(e):
+                raise
+            events1 = create()
+        self._input = []
+        tool_calls = {}
+        # Container files are downloaded concurrently while the response keeps streaming
+        executor = ThreadPoolExecutor(max_workers=4)
+        fetches = []
+        def fetch(category, annotation):
+            section.update(
+                category,
+                b"",
+                filename=annotation["filename"],
+                file_id=annotation["file_id"]
+            )
+            fetches.append((section.last_block, executor.submit(
+                lambda: self._client.containers.files.content.retrieve(
+                    file_id=annotation["file_id"],
+                    container_id=self._container_id
+                ).read()
+            )))
+        def on_completed(event):
+            self._previous_response_id = event.response.id
+            self.input_tokens += event.response.usage.input_tokens
+            self.output_tokens += event.response.usage.output_tokens
+        def on_text_delta(event):
+            section.update("text", event.delta)
+            # Links are rewritten before the text is rendered
+            section.last_block.replace_sandbox_links(event.delta)
+            section.stream_when_due()
+        def on_code_delta(event):
+            section.update_and_stream("code", event.delta)
+        def on_output_item_done(event):
+            nonlocal cache_key
+            # Answers that depend on tools may change between requests
+            if event.item.type not in ["message", "reasoning"]:
+                cache_key = None
+            if event.item.type == "function_call":
+                tool_calls[event.item.call_id] = event.item
+            else:
+                section.flush()
+        def on_reasoning_delta(event):
+            section.update_and_stream("reasoning", event.delta)
+        def on_reasoning_done(event):
+            section.last_block.append("\n\n")
+        def on_partial_image(event):
+            section.update_and_stream(
+                "generated_image",
+                base64.b64decode(event.partial_image_b64),
+                filename=f"{event.item_id}.{event.output_format}",
+                file_id=event.item_id
+            )
+        def on_annotation_added(event):
+            if event.annotation["type"] == "file_citation":
+                pass
+            elif event.annotation["type"] == "container_file_citation":
+                if event.annotation["file_id"] in event.annotation["filename"]:
+                    if Path(event.annotation["filename"]).suffix.lower() in [".png", ".jpg", ".jpeg"]:
+                        fetch("image", event.annotation)
+                else:
+                    fetch("download", event.annotation)
+        handlers = {
+            "response.completed": on_completed,
+            "response.output_text.delta": on_text_delta,
+            "response.code_interpreter_call_code.delta": on_code_delta,
+            "response.output_item.done": on_output_item_done,
+            "response.reasoning_summary_text.delta": on_reasoning_delta,
+            "response.reasoning_summary_text.done": on_reasoning_done,
+            "response.image_generation_call.partial_image": on_partial_image,
+            "response.output_text.annotation.added": on_annotation_added,
+        }
+        def handle(events):
+            # Held back deltas are shown when the stream stalls
+            for event in _iter_in_background(events, on_idle=section.flush):
+                handler = handlers.get(event.type)
+                if handler is not None:
+                    handler(event)
+                else:
+                    # Show held back deltas before a possible pause, e.g., while code runs
+                    section.flush()
+            section.flush()
+        handle(events1)
+        # Function outputs are sent back until the model stops calling functions
+        for _ in range(MAX_TOOL_ROUNDS):
+            if not tool_calls:
+                break
+            for call_id, result in zip(tool_calls, self.call_functions(list(tool_calls.values()))):
+                self._input.append({
+                    "type": "function_call_output",
+                    "call_id": call_id,
+                    # Structured results are sent as JSON so the model can parse them
+                    "output": result if isinstance(result, str) else _json_dumps(result)
+                })
+            tool_calls.clear()
+            events2 = create()
+            self._input = []
+            handle(events2)
+        # Calls left after the last round still need outputs, or the next request is rejected
+        for call_id in tool_calls:
+            self._input.append({
+                "type": "function_call_output",
+                "call_id": call_id,
+                "output": f"Error: function calls stopped after {MAX_TOOL_ROUNDS} rounds."
+            })
+        tool_calls.clear()
+        executor.shutdown()
+        for block, future in fetches:
+            block.content = future.result()
+        if fetches:
+            # Fetched files fill their blocks without going through update
+            section.mark_changed()
+            section.stream()
+        if cache_key is not None and not section.empty:
+            _cache_response(cache_key, (
+                self._previous_response_id,
+                [(x.category, x.content) for x in section.blocks]
+            ))
+
+    def fall_back_to_file_search(self, error: openai.BadRequestError) -> bool:
+        """Moves pending PDF file inputs to file search if the error rejected one of them."""
+        tracked_files = [x for x in self._tracked_files if x._file_input is not None and x._file_input in self._input]
+        match = INPUT_PARAM_PATTERN.match(error.param or "")
+        index = int(match.group(1)) if match is not None else len(self._input)
+        rejected = self._input[index] if index < len(self._input) else None
+        if not any(rejected is x._file_input for x in tracked_files):
+            return False
+        for tracked_file in tracked_files:
+            self._input.remove(tracked_file._file_input)
+            tracked_file._file_input = None
+            tracked_file._skip_file_search = False
+        if self.allow_file_search:
+            self.attach_to_file_search(tracked_files)
+        return bool(tracked_files)
+
+    def attach_to_file_search(self, tracked_files) -> None:
+        """Indexes files in the chat's dynamic vector store, as a single batch if there are several."""
+        if not tracked_files:
+            return
+        vector_store_id = self.ensure_vector_store()
+        if len(tracked_files) == 1:
+            file_id = tracked_files[0]._openai_file.id
+            self._client.vector_stores.files.create(
+                vector_store_id=vector_store_id,
+                file_id=file_id
+            )
+            result = _poll_until_done(
+                lambda: self._client.vector_stores.files.retrieve(
+                    file_id=file_id,
+                    vector_store_id=vector_store_id,
+                )
+            )
+            failed_ids = set() if result.status == "completed" else {file_id}
+        else:
+            batch = self._client.vector_stores.file_batches.create(
+                vector_store_id=vector_store_id,
+                file_ids=[x._openai_file.id for x in tracked_files]
+            )
+            result = _poll_until_done(
+                lambda: self._client.vector_stores.file_batches.retrieve(
+                    batch_id=batch.id,
+                    vector_store_id=vector_store_id,
+                )
+            )
+            failed_ids = set()
+            if result.status != "completed" or result.file_counts.failed:
+                completed_ids = {x.id for x in self._client.vector_stores.file_batches.list_files(
+                    batch_id=batch.id,
+                    vector_store_id=vector_store_id,
+                    filter="completed",
+                )}
+                failed_ids = {x._openai_file.id for x in tracked_files} - completed_ids
+        for tracked_file in tracked_files:
+            tracked_file._file_search_pending = False
+            # A file that cannot be indexed is left out of file search rather than breaking the chat
+            if tracked_file._openai_file.id in failed_ids:
+                try:
+                    self._client.vector_stores.files.delete(
+                        file_id=tracked_file._openai_file.id,
+                        vector_store_id=vector_store_id,
+                    )
+                except openai.NotFoundError:
+                    pass
+                st.warning(f"{tracked_file._file_path.name} could not be indexed for file search and was skipped.")
+        if all(x._openai_file.id in failed_ids for x in tracked_files):
+            return
+        with self._lock:
+            tool = self._tools_by_type.get("file_search")
+            if tool is None:
+                self.add_tool({
+                    "type": "file_search",
+                    "vector_store_ids": [vector_store_id]
+                })
+            elif vector_store_id not in tool["vector_store_ids"]:
+                tool["vector_store_ids"].append(vector_store_id)
+
+    def ensure_vector_store(self) -> str:
+        """Creates the dynamic vector store on first use and returns its ID."""
+        with self._lock:
+            if self._dynamic_vector_store is None:
+                self._dynamic_vector_store = self._client.vector_stores.create(
+                    name="streamlit-openai"
+                )
+            return self._dynamic_vector_store.id
+
+    def ensure_container(self) -> str:
+        """Creates the code interpreter container on first use (or after it expires) and returns its ID."""
+        with self._lock:
+            if self._container_id is None:
                 container = self._client.containers.create(name="streamlit-openai")
                 self._container_id = container.id
                 for tracked_file in self._tracked_files:
@@ -355,98 +803,40 @@ class Chat():
                             container_id=self._container_id,
                             file_id=tracked_file._openai_file.id,
                         )
-            for tool in self._tools:
-                if tool["type"] == "code_interpreter":
+                tool = self._tools_by_type.get("code_interpreter")
+                if tool is not None:
                     tool["container"] = self._container_id
-        events1 = self._client.responses.create(
-            model=self.model,
-            input=self._input,
-            instructions=DEVELOPER_MESSAGE+self.instructions,
-            temperature=self.temperature,
-            tools=self._tools,
-            previous_response_id=self._previous_response_id,
-            stream=True,
-            reasoning={"summary": "auto"},
-        )
-        self._input = []
-        tool_calls = {}
-        for event1 in events1:
-            if event1.type == "response.completed":
-                self._previous_response_id = event1.response.id
-                self.input_tokens += event1.response.usage.input_tokens
-                self.output_tokens += event1.response.usage.output_tokens
-            elif event1.type == "response.output_text.delta":
-                self.last_section.update_and_stream("text", event1.delta)
-                self.last_section.last_block.content = re.sub(r"!?\[([^\]]+)\]\(sandbox:/mnt/data/([^\)]+)\)", r"\1 (`\2`)", self.last_section.last_block.content)
-            elif event1.type == "response.code_interpreter_call_code.delta":
-                self.last_section.update_and_stream("code", event1.delta)
-            elif event1.type == "response.output_item.done" and event1.item.type == "function_call":   
-                tool_calls[event1.item.name] = event1
-            elif event1.type == "response.reasoning_summary_text.delta":
-                self.last_section.update_and_stream("reasoning", event1.delta)
-            elif event1.type == "response.reasoning_summary_text.done":
-                self.last_section.last_block.content += "\n\n"
-            elif event1.type == "response.image_generation_call.partial_image":
-                self.last_section.update_and_stream(
-                    "generated_image",
-                    base64.b64decode(event1.partial_image_b64),
-                    filename=f"{event1.item_id}.{event1.output_format}",
-                    file_id=event1.item_id
-                )
-            elif event1.type == "response.output_text.annotation.added":
-                if event1.annotation["type"] == "file_citation":
-                    pass
-                elif event1.annotation["type"] == "container_file_citation":                
-                    if event1.annotation["file_id"] in event1.annotation["filename"]:
-                        if Path(event1.annotation["filename"]).suffix in [".png", ".jpg", ".jpeg"]:
-                            image_content = self._client.containers.files.content.retrieve(
-                                file_id=event1.annotation["file_id"],
-                                container_id=self._container_id
-                            )
-                            self.last_section.update_and_stream(
-                                "image",
-                                image_content.read(),
-                                filename=event1.annotation["filename"],
-                                file_id=event1.annotation["file_id"]
-                            )
-                    else:
-                        cfile_content = self._client.containers.files.content.retrieve(
-                            file_id=event1.annotation["file_id"],
-                            container_id=self._container_id
-                        )
-                        self.last_section.update_and_stream(
-                            "download",
-                            cfile_content.read(),
-                            filename=event1.annotation["filename"],
-                            file_id=event1.annotation["file_id"]
-                        )
-        if tool_calls:
-            for tool in tool_calls:
-                function = [x for x in self.functions if x.name == tool][0]
-                result = function.handler(**json.loads(tool_calls[tool].item.arguments))
-                self._input.append({
-                    "type": "function_call_output",
-                    "call_id": tool_calls[tool].item.call_id,
-                    "output": str(result)
-                })
-            events2 = self._client.responses.create(
-                model=self.model,
-                input=self._input,
-                instructions=DEVELOPER_MESSAGE+self.instructions,
-                temperature=self.temperature,
-                tools=self._tools,
-                previous_response_id=self._previous_response_id,
-                stream=True,
-            )
-            self._input = []
-            for event2 in events2:
-                if event2.type == "response.completed":
-                    self._previous_response_id = event2.response.id
-                elif event2.type == "response.output_text.delta":
-                    self.last_section.update_and_stream("text", event2.delta)
+                else:
+                    self.add_tool({"type": "code_interpreter", "container": self._container_id})
+            return self._container_id
+
+    def add_tool(self, tool) -> None:
+        """Adds a tool, indexing the first tool of each type for quick lookup."""
+        self._tools.append(tool)
+        self._tools_by_type.setdefault(tool["type"], tool)
+
+    def call_functions(self, items) -> List[Any]:
+        """Runs the handlers of the requested function calls, concurrently if there are several."""
+        def call(item):
+            function = self._functions_by_name.get(item.name)
+            if function is None:
+                # Report an unknown function to the model rather than failing the response
+                return f"Error: function '{item.name}' does not exist."
+            return function.handler(**_json_loads(item.arguments))
+        if len(items) == 1:
+            return [call(items[0])]
+        # Handlers may use Streamlit, so worker threads share the script run context
+        ctx = get_script_run_ctx()
+        with ThreadPoolExecutor(
+            max_workers=len(items),
+            initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
+        ) as executor:
+            return list(executor.map(call, items))
 
     def run(self, uploaded_files=None) -> None:
         """Runs the main assistant loop."""
+        # Keys restart with every rerun so the history's download buttons keep the same keys
+        self._download_button_key = 0
         if self.info_message is not None:
             st.info(self.info_message)
         for section in self._sections:
@@ -478,10 +868,11 @@ class Chat():
                 st.markdown(prompt)
                 section.update("text", prompt)
             self._sections.append(section)
+            self._has_user_turn = True
             self.handle_files(uploaded_files)
             self.respond(prompt)
         else:
-            if self.example_messages is not None and not any(section.role == "user" for section in self._sections):
+            if self.example_messages is not None and not self._has_user_turn:
                 if self._selected_example is None:
                     selected_example = st.pills(
                         "Examples",
@@ -499,18 +890,27 @@ class Chat():
                         blocks=[self.create_block("text", self._selected_example)]
                     )
                     self.respond(self._selected_example)
-        if self.summary == "New Chat":
-            self.summarize()
+        # The summary is generated in the background so it does not hold up the rerun
+        if self.summary == "New Chat" and (self._summary_thread is None or not self._summary_thread.is_alive()):
+            # Reruns that did not change the conversation do not ask for another summary
+            fingerprint = (len(self._sections), sum(len(x.content) for section in self._sections for x in section.blocks or []))
+            if fingerprint != self._summary_fingerprint:
+                self._summary_fingerprint = fingerprint
+                self._summary_thread = threading.Thread(target=self.summarize, daemon=True)
+                self._summary_thread.start()
 
     def handle_files(self, uploaded_files) -> None:
         """Handles uploaded files."""
         if uploaded_files is None:
             return
         else:
+            new_files = {}
             for uploaded_file in uploaded_files:
-                if uploaded_file.file_id in [x.uploaded_file.file_id for x in self._tracked_files if isinstance(x, UploadedFile)]:
-                    continue
-                self.track(uploaded_file)
+                if uploaded_file.file_id not in self._tracked_file_ids:
+                    new_files.setdefault(uploaded_file.file_id, uploaded_file)
+            self.track_files(list(new_files.values()))
+            # Files are only marked as tracked once they are registered, so a failed upload is retried
+            self._tracked_file_ids.update(new_files)
 
     class TrackedFile():
         """A file that is tracked by the chat."""
@@ -520,7 +920,8 @@ class Chat():
             uploaded_file: Optional[Union[UploadedFile, str]]
         ) -> None:
             """
-            Initializes a TrackedFile instance.
+            Initializes a TrackedFile instance. Nothing is sent to OpenAI
+            until `register` is called.
             
             Args:
                 chat (Chat): The parent Chat object.
@@ -532,103 +933,169 @@ class Chat():
             self._openai_file = None
             self._vision_file = None
             self._skip_file_search = False
+            self._file_search_pending = False
             self._is_container_file = False
+            self._file_input = None
+            self._sha256 = None
+            self._input = []
 
             if isinstance(self.uploaded_file, str):
                 self._file_path = Path(self.uploaded_file).resolve()
+                self._on_disk = True
             elif isinstance(self.uploaded_file, UploadedFile):
-                self._file_path = Path(os.path.join(self.chat._temp_dir.name, self.uploaded_file.name))
-                with open(self._file_path, "wb") as f:
-                    f.write(self.uploaded_file.getvalue())
+                # Files only used by file search are read from memory; the local path
+                # message is the only file name hint for custom functions, code
+                # interpreter and vision files
+                suffix = Path(self.uploaded_file.name).suffix.lower()
+                self._on_disk = (
+                    self.chat.functions is not None
+                    or not self.chat.allow_file_search
+                    or suffix not in FILE_SEARCH_EXTENSIONS
+                    or suffix in VISION_EXTENSIONS
+                    or (self.chat.allow_code_interpreter and suffix in CODE_INTERPRETER_EXTENSIONS)
+                )
+                if not self._on_disk:
+                    self._file_path = Path(self.uploaded_file.name)
+                else:
+                    self._file_path = Path(self.chat.temp_dir.name, self.uploaded_file.name)
+                    self.uploaded_file.seek(0)
+                    with open(self._file_path, "wb") as f:
+                        shutil.copyfileobj(self.uploaded_file, f, 1024 * 1024)
             else:
                 raise ValueError("uploaded_file must be an instance of UploadedFile or a string representing the file path.")
 
-            self.chat._input.append(
-                {"role": "user", "content": [{"type": "input_text", "text": f"File locally available at: {self._file_path}"}]}
-            )
+            # Extensions are matched case-insensitively (e.g., "report.PDF")
+            self._suffix = self._file_path.suffix.lower()
 
-            if self._file_path.suffix == ".pdf":
+            if self._on_disk:
+                self._input.append(
+                    {"role": "user", "content": [{"type": "input_text", "text": f"File locally available at: {self._file_path}"}]}
+                )
+
+        def open(self) -> BinaryIO:
+            """Opens the file's content for reading, from disk or from the uploaded file in memory."""
+            if self._on_disk:
+                return open(self._file_path, "rb")
+            return io.BytesIO(self.uploaded_file.getvalue())
+
+        def register(self) -> None:
+            """Uploads the file to OpenAI and attaches it to the relevant tools."""
+            if self._suffix == ".pdf":
                 if self._openai_file is None:
-                    with open(self._file_path, "rb") as f:
-                        self._openai_file = self.chat._client.files.create(file=f, purpose="user_data")
-                try:
-                    # Test if the PDF file can be processed
-                    response = self.chat._client.responses.create(
-                        model=self.chat.model,
-                        input=[{
-                            "role": "user",
-                            "content": [{"type": "input_file", "file_id": self._openai_file.id
-                        }]}]
-                    )
-                    self.chat._input.append({
+                    self._openai_file = self.upload("user_data")
+                with self.open() as f:
+                    processable = _is_pdf_processable(f)
+                if processable:
+                    self._file_input = {
                         "role": "user",
                         "content": [{"type": "input_file", "file_id": self._openai_file.id}]
-                    })
+                    }
+                    self._input.append(self._file_input)
                     self._skip_file_search = True
-                except Exception as e:
-                    pass
 
-            if self._file_path.suffix in VISION_EXTENSIONS:
-                self._vision_file = self.chat._client.files.create(file=self._file_path, purpose="vision")
-                self.chat._input.append({
+            if self._suffix in VISION_EXTENSIONS:
+                self._vision_file = self.upload("vision")
+                self._input.append({
                     "role": "user",
                     "content": [{"type": "input_image", "file_id": self._vision_file.id}]
                 })
 
-            if self.chat.allow_code_interpreter and self._file_path.suffix in CODE_INTERPRETER_EXTENSIONS:
+            if self.chat.allow_code_interpreter and self._suffix in CODE_INTERPRETER_EXTENSIONS:
                 # If an image file is uploaded for vision purposes but is also 
                 # supported by the code interpreter, it will be automatically 
                 # uploaded to the code interpreter container.
-                if self._file_path.suffix in VISION_EXTENSIONS:
+                if self._suffix in VISION_EXTENSIONS:
                     self._openai_file = self._vision_file
                 if self._openai_file is None:
-                    with open(self._file_path, "rb") as f:
-                        self._openai_file = self.chat._client.files.create(file=f, purpose="user_data")
+                    self._openai_file = self.upload("user_data")
                 self.chat._client.containers.files.create(
-                    container_id=self.chat._container_id,
+                    container_id=self.chat.ensure_container(),
                     file_id=self._openai_file.id,
                 )
                 self._is_container_file = True
 
-            if self.chat.allow_file_search and not self._skip_file_search and self._file_path.suffix in FILE_SEARCH_EXTENSIONS:
+            # Indexing is left to the chat so that files can be added to the vector store in one batch
+            if self.chat.allow_file_search and not self._skip_file_search and self._suffix in FILE_SEARCH_EXTENSIONS:
                 if self._openai_file is None:
-                    with open(self._file_path, "rb") as f:
-                        self._openai_file = self.chat._client.files.create(file=f, purpose="user_data")
-                if self.chat._dynamic_vector_store is None:
-                    self.chat._dynamic_vector_store = self.chat._client.vector_stores.create(
-                        name="streamlit-openai"
-                    )
-                self.chat._client.vector_stores.files.create(
-                    vector_store_id=self.chat._dynamic_vector_store.id,
-                    file_id=self._openai_file.id
-                )
-                result = self.chat._client.vector_stores.retrieve(
-                    vector_store_id=self.chat._dynamic_vector_store.id,
+                    self._openai_file = self.upload("user_data")
+                self._file_search_pending = True
+
+        @property
+        def sha256(self) -> str:
+            """Returns the SHA-256 digest of the file's content, reading the file only once."""
+            if self._sha256 is None:
+                digest = hashlib.sha256()
+                with self.open() as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(chunk)
+                self._sha256 = digest.hexdigest()
+            return self._sha256
+
+        def upload(self, purpose) -> Any:
+            """Uploads the file to OpenAI, reusing an earlier upload of the same content."""
+            # The name is part of the key since the uploaded file carries it into tool outputs
+            key = f"{purpose}:{self._file_path.name}:{self.sha256}"
+            shared_cache = _get_file_hash_cache(self.chat.api_key)
+            file_id = self.chat._file_hash_cache.get(key, shared_cache.get(key))
+            if file_id is not None:
+                try:
+                    openai_file = self.chat._client.files.retrieve(file_id)
+                    if openai_file.filename == self._file_path.name:
+                        self.chat._file_hash_cache[key] = openai_file.id
+                        return openai_file
+                except openai.NotFoundError:
+                    pass
+            # The SDK reads from the open file, so the content is not held in memory twice
+            with self.open() as f:
+                openai_file = self.chat._client.files.create(
+                    file=(self._file_path.name, f), purpose=purpose
                 )
-                while result.status != "completed":
-                    time.sleep(1)
-                    result = self.chat._client.vector_stores.retrieve(
-                        vector_store_id=self.chat._dynamic_vector_store.id,
-                    )
-                for tool in self.chat._tools:
-                    if tool["type"] == "file_search":
-                        if self.chat._dynamic_vector_store.id not in tool["vector_store_ids"]:
-                            tool["vector_store_ids"].append(self.chat._dynamic_vector_store.id)
-                        break
-                else:
-                    self.chat._tools.append({
-                        "type": "file_search",
-                        "vector_store_ids": [self.chat._dynamic_vector_store.id]
-                    })
+            # Only files uploaded by this process are shared, never entries from a loaded history
+            self.chat._file_hash_cache[key] = openai_file.id
+            shared_cache[key] = openai_file.id
+            return openai_file
 
         def __repr__(self) -> None:
             return f"TrackedFile(uploaded_file='{self._file_path.name}')"
         
+    def track_static_files(self, uploaded_files) -> None:
+        """Tracks statically uploaded files, keeping copies for the chat history."""
+        temp_dir = Path(self.temp_dir.name).resolve()
+        copies = []
+        for uploaded_file in uploaded_files:
+            file_path = Path(uploaded_file).resolve()
+            # Files restored by load() are already in the temporary directory
+            if file_path.parent != temp_dir:
+                shutil.copy(file_path, temp_dir)
+            copies.append(str(temp_dir / file_path.name))
+        self.track_files(copies)
+        self._static_files.extend(self._tracked_files[len(self._tracked_files) - len(copies):])
+
     def track(self, uploaded_file) -> None:
         """Tracks a file uploaded by the user."""
-        self._tracked_files.append(
-            self.TrackedFile(self, uploaded_file)
-        )
+        self.track_files([uploaded_file])
+
+    def track_files(self, uploaded_files) -> None:
+        """Tracks files uploaded by the user, registering them with OpenAI concurrently."""
+        tracked_files = [self.TrackedFile(self, x) for x in uploaded_files]
+        tasks = [x.register for x in tracked_files]
+        # The vector store does not depend on the uploads, so it is created alongside them
+        # (PDFs are left out since they are usually passed to the model as file inputs)
+        if self.allow_file_search and self._dynamic_vector_store is None and any(
+            x._suffix in FILE_SEARCH_EXTENSIONS and x._suffix != ".pdf" for x in tracked_files
+        ):
+            tasks.append(self.ensure_vector_store)
+        if len(tasks) > 1:
+            with ThreadPoolExecutor(max_workers=min(8, len(tasks))) as executor:
+                list(executor.map(lambda x: x(), tasks))
+        else:
+            for task in tasks:
+                task()
+        self.attach_to_file_search([x for x in tracked_files if x._file_search_pending])
+        # Inputs are added in upload order regardless of which upload finished first
+        for tracked_file in tracked_files:
+            self._tracked_files.append(tracked_file)
+            self._input.extend(tracked_file._input)
 
     class Block():
         """A block of content in the chat."""
@@ -652,14 +1119,14 @@ class Chat():
             """
             self.chat = chat
             self.category = category
-            self.content = content
+            self.content = "" if content is None else content
             self.filename = filename
             self.file_id = file_id
-
-            if self.content is None:
-                self.content = ""
-            else:
-                self.content = content
+            self._scan_from = 0
+            self._mime = None
+            if category == "download":
+                # Unknown extensions are offered as generic binary files
+                self._mime = MIME_TYPES.get(Path(filename).suffix.lstrip(".").lower(), "application/octet-stream")
 
         def __repr__(self) -> None:
             """Returns a string representation of the Block."""
@@ -672,13 +1139,46 @@ class Chat():
                 content = "Bytes"
             return f"Block(category='{self.category}', content={content}, filename='{self.filename}', file_id='{self.file_id}')"
 
+        @property
+        def content(self) -> Union[str, bytes]:
+            """Returns the block's content, joining any streamed parts first."""
+            if len(self._parts) > 1:
+                self._parts = ["".join(self._parts)]
+            return self._parts[0]
+
+        @content.setter
+        def content(self, content) -> None:
+            """Replaces the block's content."""
+            self._parts = [content]
+
+        def append(self, content) -> None:
+            """Appends streamed text to the block's content."""
+            self._parts.append(content)
+
+        def replace_sandbox_links(self, delta) -> None:
+            """Rewrites sandbox file links completed by the newly streamed delta."""
+            # A link can only be completed by its closing parenthesis
+            if ")" not in delta:
+                return
+            content = self.content
+            tail = content[self._scan_from:]
+            replaced = SANDBOX_LINK_PATTERN.sub(r"\1 (`\2`)", tail)
+            if replaced != tail:
+                content = content[:self._scan_from] + replaced
+                self.content = content
+            # Resume from a link that is still being streamed, if there is one
+            self._scan_from = PENDING_LINK_PATTERN.search(content, self._scan_from).start()
+
         def iscategory(self, category) -> bool:
             """Checks if the block belongs to the specified category."""
             return self.category == category
 
         def write(self) -> None:
             """Renders the block's content to the chat."""
-            if self.category == "text":
+            if not self.content:
+                # Nothing to show yet, e.g., a container file still being downloaded
+                pass
+            elif self.category == "text":
                 st.markdown(self.content)
             elif self.category == "code":
                 with st.expander("", expanded=False, icon=":material/code:"):
@@ -689,12 +1189,11 @@ class Chat():
             elif self.category in ["image", "generated_image"]:
                 st.image(self.content)
             elif self.category == "download":
-                _, file_extension = os.path.splitext(self.filename)
                 st.download_button(
                     label=self.filename,
                     data=self.content,
                     file_name=self.filename,
-                    mime=MIME_TYPES[file_extension.lstrip(".")],
+                    mime=self._mime,
                     icon=":material/download:",
                     key=self.chat._download_button_key,
                 )
@@ -728,6 +1227,10 @@ class Chat():
             self.role = role
             self.blocks = blocks
             self.delta_generator = st.empty()
+            self._changes = 0
+            self._last_rendered_changes = None
+            self._last_streamed_at = 0.0
+            self._pending = False
             
         def __repr__(self) -> None:
             """Returns a string representation of the Section."""
@@ -745,12 +1248,13 @@ class Chat():
 
         def update(self, category, content, filename=None, file_id=None) -> None:
             """Updates the section with new content, appending or extending existing blocks."""
+            self.mark_changed()
             if self.empty:
                 self.blocks = [self.chat.create_block(
                     category, content, filename=filename, file_id=file_id
                 )]
             elif category in ["text", "code", "reasoning"] and self.last_block.iscategory(category):
-                self.last_block.content += content
+                self.last_block.append(content)
             elif category == "generated_image" and self.last_block.iscategory(category):
                 self.last_block.content = content
             else:
@@ -768,12 +1272,33 @@ class Chat():
                         block.write()
 
         def update_and_stream(self, category, content, filename=None, file_id=None) -> None:
-            """Updates the section and streams the update live to the UI."""
+            """Updates the section and streams the update live to the UI, at most once per STREAM_INTERVAL."""
             self.update(category, content, filename=filename, file_id=file_id)
-            self.stream()
+            self.stream_when_due()
+
+        def stream_when_due(self) -> None:
+            """Streams the section if STREAM_INTERVAL has passed since the last render, or holds it back for flush."""
+            if time.monotonic() - self._last_streamed_at >= STREAM_INTERVAL:
+                self.stream()
+            else:
+                self._pending = True
+
+        def mark_changed(self) -> None:
+            """Records a change to the section's blocks so the next stream renders it."""
+            self._changes += 1
+
+        def flush(self) -> None:
+            """Renders any updates held back by update_and_stream."""
+            if self._pending:
+                self.stream()
 
         def stream(self) -> None:
             """Renders the section content using Streamlit's delta generator."""
+            self._last_streamed_at = time.monotonic()
+            self._pending = False
+            if not self.empty and self._changes == self._last_rendered_changes:
+                return
+            self._last_rendered_changes = self._changes
             with self.delta_generator:
                 self.write()
 
@@ -785,4 +1310,6 @@ class Chat():
         """Adds a new Section."""
         self._sections.append(
             self.Section(self, role, blocks=blocks)
-        )
\ No newline at end of file
+        )
+        if role == "user":
+            self._has_user_turn = True
\ No newline at end of file